@@ -2,20 +2,86 @@
 from controller import Supervisor
 import math
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder if orjson isn't installed
+    orjson = None
+    import json
 import time
+import queue
+import threading
+import atexit
+import logging
+import sys
+from collections import namedtuple
 from datetime import datetime, timezone
 
 
+# Per-tick movement/rotation output is DEBUG; set the level to logging.DEBUG to see it.
+# Logs go to stdout alongside the print() output, since Webots shows stderr as errors.
+logging.basicConfig(format="%(message)s", stream=sys.stdout)
+log = logging.getLogger("ctrl")
+log.setLevel(logging.INFO)
+
 # Create the Supervisor instance (inherits from Robot).
 robot = Supervisor()
+
+# Cache values that never change so we don't cross into Webots on every log / API call
+ROBOT_NAME = robot.getName()
+ROBOT_NODE = robot.getSelf()
+ROTATION_FIELD = ROBOT_NODE.getField("rotation") if ROBOT_NODE is not None else None
+
 TIME_STEP = 32
 ROTATING_SPEED = 8.0
 SPEED = 5.0
 
 BASE_URL = "http://localhost:4000"
+HTTP_TIMEOUT = (1.0, 2.0)  # (connect, read) seconds - never stall the step loop on the API
+
+# One pooled session for every API call so TCP connections are kept alive and reused
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    # read=False: a read timeout means the server already has the request, so don't re-send it
+    # (this also lets the long-poll surface its read timeout instead of a retried ConnectionError)
+    max_retries=Retry(total=2, read=False, backoff_factor=0.1)
+))
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _dumps(payload):
+    """Serialize a payload to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+def _loads(content):
+    """Parse a JSON response body"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _send(method, url, payload):
+    """Send payload as a JSON body and return the raw response"""
+    return SESSION.request(method, url, data=_dumps(payload), headers=_JSON_HEADERS, timeout=HTTP_TIMEOUT)
+
+def _ok(resp):
+    """Parse a response body, or return None for non-200 / non-JSON responses"""
+    if resp.status_code != 200:
+        return None
+    try:
+        return _loads(resp.content)
+    except ValueError:
+        return None
 
-response = requests.get(f"{BASE_URL}/warehouse/get-shelves")
-shelves_json = response.json()
+def _post(url, payload):
+    return _ok(_send("POST", url, payload))
+
+def _patch(url, payload):
+    return _ok(_send("PATCH", url, payload))
 
 shelves = {}  # final dictionary
 available_robots = []
@@ -27,31 +93,62 @@ BATTERY = 0
 CAN_QUANTITY = 0
 CURRENT_JOB_ID = 0
 JOB_IN_PROGRESS = False
+BOOT_JOB = None  # job already assigned when the controller started, if any
 
-try:
-    if shelves_json["success"] and len(shelves_json["data"]) > 0:
-        for shelf in shelves_json["data"]:
-            name = shelf["name"]
-            slots = shelf["slots"]
+BOOTSTRAP_TIMEOUT = (2.0, 5.0)
 
-            shelves[name] = {
-                "slots": slots
-            }
+def load_shelves(shelf_list):
+    for shelf in shelf_list:
+        name = shelf["name"]
+        slots = shelf["slots"]
 
+        shelves[name] = {
+            "slots": slots
+        }
+
+# Fetch shelves, battery and any assigned job in one request
+try:
+    boot_json = _ok(SESSION.get(f"{BASE_URL}/warehouse/bootstrap/{ROBOT_NAME}", timeout=BOOTSTRAP_TIMEOUT))
 except Exception as e:
-    print("Error fetching shelves :", e)
-    
-robotId = robot.getName()
-battery_response = requests.get(f"{BASE_URL}/warehouse/get-battery-level/{robotId}")
-battery_json = battery_response.json()
+    print("Error bootstrapping robot :", e)
+    boot_json = None
 
-try : 
-    if battery_json["success"] :
-        BATTERY = battery_json["data"]
+bootstrapped = False
+if boot_json and boot_json.get("success"):
+    try:
+        boot = boot_json["data"]
+        load_shelves(boot["shelves"])
+        BATTERY = boot["battery"]
         print(f"✓ Battery level initialized: {BATTERY}%")
+        if boot.get("job"):
+            BOOT_JOB = boot["job"]
+        bootstrapped = True
+            
+    except Exception as e:
+        print("Error bootstrapping robot :", e)
         
-except Exception as e:
-    print("Error fetching Battery :", e)
+if not bootstrapped:
+    # Older API without the bootstrap endpoint (or it failed) - fetch shelves and battery separately
+    response = SESSION.get(f"{BASE_URL}/warehouse/get-shelves", timeout=HTTP_TIMEOUT)
+    shelves_json = _ok(response)
+
+    try:
+        if shelves_json and shelves_json.get("success") and len(shelves_json["data"]) > 0:
+            load_shelves(shelves_json["data"])
+
+    except Exception as e:
+        print("Error fetching shelves :", e)
+        
+    battery_response = SESSION.get(f"{BASE_URL}/warehouse/get-battery-level/{ROBOT_NAME}", timeout=HTTP_TIMEOUT)
+    battery_json = _ok(battery_response)
+
+    try : 
+        if battery_json and battery_json.get("success") :
+            BATTERY = battery_json["data"]
+            print(f"✓ Battery level initialized: {BATTERY}%")
+            
+    except Exception as e:
+        print("Error fetching Battery :", e)
     
 
 # Get sensors
@@ -66,6 +163,7 @@ for name in wheel_names:
     m.setPosition(float('inf'))  # infinite rotation (velocity mode)
     m.setVelocity(0)
     wheels.append(m)
+W0, W1, W2, W3 = wheels
 
 # Get arm and finger motors
 arms = [robot.getDevice(f"arm{i+1}") for i in range(5)]
@@ -73,6 +171,8 @@ fingers = [
     robot.getDevice("finger::left"),
     robot.getDevice("finger::right")
 ]
+ALL_MOTORS = tuple(arms + fingers)
+FINGER_L, FINGER_R = fingers
 
 # Control variables
 current_waypoint_index = 0
@@ -80,65 +180,113 @@ rotation_start_time = None
 is_rotating = False
 rotation_direction = None  # 'left' or 'right'
 current_rotation_duration = 0
+rotation_target_angle = None  # radians for angle-based turns, None for timed turns
+rotation_start_yaw = 0.0
+# The timed ("turn_right", 11.0) quarter turn, used to estimate how long an angle turn should take
+TURN_SECONDS_PER_RAD = 11.0 / (math.pi / 2)
+ANGLE_TURN_TIMEOUT_FACTOR = 3.0  # give up on an angle turn after this many times its expected time
+last_progress_log = 0.0  # sim time of the last rotation progress message
+pick_stages = None  # stages of the pick sequence in progress
+pick_stage_idx = 0
+pick_stage_deadline = 0.0
+
+# Last wheel command sent - repeated commands are skipped to save Webots calls every tick
+_last_velocity_cmd = ("stop",)
 
-def wait(seconds):
-    """Wait for specified seconds while stepping the simulation"""
-    start = robot.getTime()
-    while robot.step(TIME_STEP) != -1:
-        if robot.getTime() - start > seconds:
-            break
-    
 def rotate_left(speed=1.0):
-    wheels[0].setVelocity(-speed)
-    wheels[1].setVelocity(speed)
-    wheels[2].setVelocity(speed)
-    wheels[3].setVelocity(-speed)
+    global _last_velocity_cmd
+    if _last_velocity_cmd == ("left", speed):
+        return
+    _last_velocity_cmd = ("left", speed)
+    W0.setVelocity(-speed)
+    W1.setVelocity(speed)
+    W2.setVelocity(speed)
+    W3.setVelocity(-speed)
 
 def rotate_right(speed=1.0):
-    wheels[0].setVelocity(speed)
-    wheels[1].setVelocity(-speed)
-    wheels[2].setVelocity(-speed)
-    wheels[3].setVelocity(speed)
+    global _last_velocity_cmd
+    if _last_velocity_cmd == ("right", speed):
+        return
+    _last_velocity_cmd = ("right", speed)
+    W0.setVelocity(speed)
+    W1.setVelocity(-speed)
+    W2.setVelocity(-speed)
+    W3.setVelocity(speed)
     
 def drive_forward(speed):
-    for w in wheels:
-        w.setVelocity(speed)
+    global _last_velocity_cmd
+    if _last_velocity_cmd == ("forward", speed):
+        return
+    _last_velocity_cmd = ("forward", speed)
+    W0.setVelocity(speed)
+    W1.setVelocity(speed)
+    W2.setVelocity(speed)
+    W3.setVelocity(speed)
         
 def drive_backward(speed):
-    for w in wheels:
-        w.setVelocity(-speed)
+    global _last_velocity_cmd
+    if _last_velocity_cmd == ("backward", speed):
+        return
+    _last_velocity_cmd = ("backward", speed)
+    W0.setVelocity(-speed)
+    W1.setVelocity(-speed)
+    W2.setVelocity(-speed)
+    W3.setVelocity(-speed)
         
 def stop():
-    for w in wheels:
-        w.setVelocity(0)
-
-def calculate_distance(pos1, pos2):
-    """Calculate Euclidean distance between two positions"""
-    return math.sqrt((pos2[0] - pos1[0])**2 + (pos2[1] - pos1[1])**2)
-
-def get_robot_node():
-    """Get the robot's node to access translation and rotation fields"""
-    return robot.getSelf()
+    global _last_velocity_cmd
+    if _last_velocity_cmd == ("stop",):
+        return
+    _last_velocity_cmd = ("stop",)
+    W0.setVelocity(0)
+    W1.setVelocity(0)
+    W2.setVelocity(0)
+    W3.setVelocity(0)
+
+def dist2(x1, y1, x2, y2):
+    """Squared Euclidean distance between two points (compare against tolerance squared)"""
+    dx = x2 - x1
+    dy = y2 - y1
+    return dx * dx + dy * dy
+
+def wrap_angle(angle):
+    """Wrap an angle to [-pi, pi)"""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+def get_robot_yaw():
+    """Get the robot's heading (rad) from its axis-angle rotation field, or None if it isn't accessible"""
+    if ROTATION_FIELD is None:
+        return None
+    x, y, z, angle = ROTATION_FIELD.getSFRotation()
+    c = math.cos(angle)
+    s = math.sin(angle)
+    t = 1 - c
+    # atan2 of the first column of the rotation matrix
+    return math.atan2(x * y * t + z * s, c + x * x * t)
 
 def set_robot_rotation(x, y, z, angle):
     """Set the robot's rotation directly"""
-    robot_node = get_robot_node()
-    if robot_node is not None:
-        rotation_field = robot_node.getField("rotation")
-        if rotation_field is not None:
-            rotation_field.setSFRotation([x, y, z, angle])
-            print(f"🔄 Robot rotation set to: axis=({x}, {y}, {z}), angle={angle:.2f} rad")
-            return True
+    if ROTATION_FIELD is not None:
+        ROTATION_FIELD.setSFRotation([x, y, z, angle])
+        print(f"🔄 Robot rotation set to: axis=({x}, {y}, {z}), angle={angle:.2f} rad")
+        return True
     print("❌ Failed to set rotation - robot node or rotation field not accessible")
     return False
 
+# Cached available slot IDs - updated in place by mark_slot_unavailable, TTL as a safety net
+AVAILABLE_SLOTS_TTL = 60  # seconds
+_AVAILABLE_SLOTS = []
+_AVAILABLE_TS = 0.0
+
 def get_available_slots():
     """Get list of available slot IDs"""
-    available = []
-    for slot in shelves["can_shelf"]["slots"]:
-        if slot["available"]:
-            available.append(slot["id"])
-    return available
+    global _AVAILABLE_SLOTS, _AVAILABLE_TS
+
+    if time.time() - _AVAILABLE_TS >= AVAILABLE_SLOTS_TTL:
+        _AVAILABLE_SLOTS = [slot["id"] for slot in shelves["can_shelf"]["slots"] if slot["available"]]
+        _AVAILABLE_TS = time.time()
+    # Return a copy so callers can iterate while slots are being marked unavailable
+    return list(_AVAILABLE_SLOTS)
 
 def mark_slot_unavailable(slot_id):
     """Mark a slot as unavailable after picking"""
@@ -148,13 +296,14 @@ def mark_slot_unavailable(slot_id):
      "slotId" : slot_id,
      "status" : False
     }
-    slot_response = requests.patch(f"{BASE_URL}/warehouse/update-slot-availability",json = payload) 
-    slot_json = slot_response.json()
     try:
-        if(slot_json.get("success")):
+        slot_json = _patch(f"{BASE_URL}/warehouse/update-slot-availability", payload)
+        if slot_json and slot_json.get("success"):
             for slot in shelves["can_shelf"]["slots"]:
                 if slot["id"] == slot_id:
                     slot["available"] = False
+                    if slot_id in _AVAILABLE_SLOTS:
+                        _AVAILABLE_SLOTS.remove(slot_id)
                     print(f"✓ Slot {slot_id} marked as unavailable")
                     return True
     except Exception as e:
@@ -162,11 +311,84 @@ def mark_slot_unavailable(slot_id):
         
     return False
     
+# Robot logs (and job start times, as JobTime items) are posted by a background worker
+# so the step loop never waits on the API
+LOG_Q = queue.Queue(maxsize=256)
+JobTime = namedtuple("JobTime", "isStartTime time_epoch jobId")
+LOG_BATCH_SIZE = 32
+LOG_BATCH_WINDOW = 0.25  # seconds to keep collecting logs into one batch
+batch_logs_supported = True  # cleared once if the server has no batch endpoint
+
+def _post_robot_log(payload):
+    """Post a single robot log (fallback when batching is not supported)"""
+    try:
+        response_json = _post(f"{BASE_URL}/warehouse/add-robot-log", payload)
+        if response_json and response_json.get("success"):
+            print(response_json.get("message"))
+    except Exception as e:
+        print("❌ Error adding robot log",e)
+
+def _post_robot_logs(batch):
+    """Post a batch of robot logs in one request, falling back to one request per log"""
+    global batch_logs_supported
+
+    if batch_logs_supported:
+        try:
+            response = _send("POST", f"{BASE_URL}/warehouse/add-robot-logs", {"logs": batch})
+            if response.status_code == 404:
+                print("ℹ️ Batch log endpoint not available - posting logs individually")
+                batch_logs_supported = False
+            else:
+                response_json = _ok(response)
+                if response_json and response_json.get("success"):
+                    print(f"✓ {len(batch)} robot log(s) added")
+                return
+        except Exception as e:
+            print("❌ Error adding robot logs",e)
+            return
+
+    for payload in batch:
+        _post_robot_log(payload)
+
+def _log_worker():
+    """Drain LOG_Q in batches and post them to the API - a JobTime ends the batch so queue order is kept"""
+    pending = None
+    while True:
+        item = pending if pending is not None else LOG_Q.get()
+        pending = None
+        if isinstance(item, JobTime):
+            _send_job_time(*item)
+            continue
+        batch = [item]
+        deadline = time.time() + LOG_BATCH_WINDOW
+        while len(batch) < LOG_BATCH_SIZE and time.time() < deadline:
+            try:
+                item = LOG_Q.get(timeout=0.05)
+            except queue.Empty:
+                break
+            if isinstance(item, JobTime):
+                pending = item
+                break
+            batch.append(item)
+        _post_robot_logs(batch)
+
+threading.Thread(target=_log_worker, daemon=True).start()
+
+# Identical logs (same status, message and rounded position) within this window are skipped
+LOG_DEBOUNCE = 0.5  # seconds
+_LAST_LOG = {}
+
 def addRobotLog(jobId , batteryPercentage , status , x , y , message):
-    robot_id = robot.getName()
+    key = (status, message, round(x, 1), round(y, 1))
+    now = time.time()
+    if now - _LAST_LOG.get(key, 0) < LOG_DEBOUNCE:
+        return
+    if len(_LAST_LOG) > 256:
+        _LAST_LOG.clear()
+    _LAST_LOG[key] = now
 
     payload = {
-    "robotId" : robot_id,
+    "robotId" : ROBOT_NAME,
     "jobId" : jobId,
     "batteryPercentage" : batteryPercentage,
     "status": status,
@@ -178,198 +400,137 @@ def addRobotLog(jobId , batteryPercentage , status , x , y , message):
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/warehouse/add-robot-log",json=payload)
-        response_json = response.json()
-        if response_json["success"]:
-            print(response_json["message"])
-    except Exception as e:
-        print("❌ Error adding robot log",e)
+        LOG_Q.put_nowait(payload)
+    except queue.Full:
+        # Drop the log rather than block the simulation
+        print("⚠️ Robot log queue full - dropping log:", message)
         
         
-def pick_can_from_slot(slot_id):
-    """
-    Execute pick and place sequence for specified slot.
-    slot_id: 1, 2, 3, or 4
-    """
-    # Stop the robot during pick and place
+def _set_fingers(position):
+    FINGER_L.setPosition(position)
+    FINGER_R.setPosition(position)
+
+def _reset_arm():
+    """Stop the robot and send every arm joint and finger back to zero"""
     stop()
-    
-    # Reset all positions first
-    print("🔄 Resetting all arm joints and fingers...")
-    for m in arms + fingers:
+    for m in ALL_MOTORS:
         try:
             m.setPosition(0.0)
         except Exception as e:
             print(f"⚠️ Could not reset a motor: {e}")
-    wait(2.0)
-    
-    # Configuration based on slot
-    if slot_id == 2:
-        print(f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} (down shelf) ===")
-        gripper_open = 0.025
-        
-        # Arm positions during lowering
-        arm2_lower = -0.80
-        arm3_during_lower = 0
-        arm4_during_lower = -0.82
-        arm4_final = -1.72
-        
-        # Drop positions
-        arm1_rotate = -2.94
-        arm2_drop = -0.52
-        arm3_drop = -0.84
-        
-        # Gripper settings
-        gripper_release = 0.02
-        release_wait = 2.0
-        
-        # Open gripper first
-        print("\n🟢 Opening gripper before movement...")
-        for f in fingers:
-            f.setPosition(gripper_open)
-        wait(2.0)
-        
-        # Lowering the arm in stages
-        print("\n⬇️ Lowering the arm in stages...")
-        print(" → Moving arm2 (lowering part 1)")
-        arms[1].setPosition(arm2_lower)
-        wait(1.5)
-        print(" → Extending arm3 slightly for extra reach")
-        arms[2].setPosition(arm3_during_lower)
-        wait(2.5)
-        print(" → Extending arm4 slightly for extra reach")
-        arms[3].setPosition(arm4_during_lower)
-        
-        print(" → Extending arm4 to final lowered position")
-        arms[3].setPosition(arm4_final)
-        wait(2.5)
-        
-    elif slot_id == 4:
-        print(f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} (upper shelf) ===")
-        gripper_open = 0.025
-        
-        # Arm positions during lowering
-        arm4_initial = 1.45
-        arm2_lower = -0.92
-        arm3_during_lower = -1.3
-        arm4_during_lower = -0.30
-        arm4_final = -1.32
-        
-        # Drop positions
-        arm1_rotate = -2.94
-        arm2_drop = -0.32
-        arm3_drop = None
-        
-        # Gripper settings
-        gripper_release = 0.02
-        release_wait = 2.0
-        
-        # Open gripper first
-        print("\n🟢 Opening gripper before movement...")
-        for f in fingers:
-            f.setPosition(gripper_open)
-        wait(2.0)
-        
-        # Lowering the arm in stages
-        print("\n⬇️ Lowering the arm in stages...")
-        print(" → Extending arm4 initial for extra reach")
-        arms[3].setPosition(arm4_initial)
-        wait(2.5)
-        print(" → Extending arm3 slightly for extra reach")
-        arms[2].setPosition(-1.15)
-        wait(2.5)
-        print(" → Moving arm2 (lowering part 1)")
-        arms[1].setPosition(arm2_lower)
-        wait(1.5)
-        print(" → Extending arm4 during lower for extra reach")
-        arms[3].setPosition(arm4_during_lower)
-        print(" → Extending arm4 to final lowered position")
-        arms[3].setPosition(arm4_final)
-        wait(2.5)
-        
-    elif slot_id == 1:
-        # Leave space for slot 1 logic
-        print(f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} ===")
-        print("⚠️ Slot 1 logic not implemented yet")
-        return
-        
-    elif slot_id == 3:
-        # Leave space for slot 3 logic
-        print(f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} ===")
-        print("⚠️ Slot 3 logic not implemented yet")
-        return
-        
+
+# Pick sequences are lists of stages: (message, action, wait_seconds).
+# The main loop runs one stage, then waits wait_seconds of simulation time before the next,
+# so it keeps stepping (and servicing everything else) while the arm moves.
+
+# Arm/gripper targets for each slot the robot knows how to pick from.
+# arm4_initial is only used by slots that need to extend arm4 before lowering.
+PickParams = namedtuple("PickParams", [
+    "shelf",
+    "gripper_open",
+    "arm4_initial",
+    "arm2_lower",
+    "arm3_lower",
+    "arm4_final",
+    "arm1_rotate",
+    "arm2_drop",
+    "arm3_drop",
+    "gripper_release",
+    "release_wait",
+])
+
+PICK_PARAMS = {
+    2: PickParams(shelf="down shelf", gripper_open=0.025, arm4_initial=None, arm2_lower=-0.80, arm3_lower=0.0,
+                  arm4_final=-1.72, arm1_rotate=-2.94, arm2_drop=-0.52, arm3_drop=-0.84,
+                  gripper_release=0.02, release_wait=2.0),
+    4: PickParams(shelf="upper shelf", gripper_open=0.025, arm4_initial=1.45, arm2_lower=-0.92, arm3_lower=-1.15,
+                  arm4_final=-1.32, arm1_rotate=-2.94, arm2_drop=-0.32, arm3_drop=None,
+                  gripper_release=0.02, release_wait=2.0),
+}
+
+RESET_STAGE = ("🔄 Resetting all arm joints and fingers...", _reset_arm, 2.0)
+
+def _build_pick_stages(slot_id, p):
+    """Build the full pick and place stage list for one slot from its parameters"""
+    # Stop the robot and reset all positions first
+    stages = [
+        RESET_STAGE,
+        (f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} ({p.shelf}) ===\n\n🟢 Opening gripper before movement...",
+         lambda: _set_fingers(p.gripper_open), 2.0),
+    ]
+    
+    # Lowering the arm in stages
+    if p.arm4_initial is not None:
+        stages += [
+            ("\n⬇️ Lowering the arm in stages...\n → Extending arm4 initial for extra reach",
+             lambda: arms[3].setPosition(p.arm4_initial), 2.5),
+            (" → Extending arm3 slightly for extra reach",
+             lambda: arms[2].setPosition(p.arm3_lower), 2.5),
+            (" → Moving arm2 (lowering part 1)",
+             lambda: arms[1].setPosition(p.arm2_lower), 1.5),
+        ]
     else:
-        print(f"❌ Invalid slot ID: {slot_id}")
-        return
-    
-    # Close the gripper
-    print("\n✊ Closing gripper (picking up object)...")
-    for f in fingers:
-        f.setPosition(0.0)
-    wait(2.5)
-    
-    # Lift and rotate arm
-    print("\n⬆️ Raising arm2 back up...")
-    arms[1].setPosition(0.75)
-    wait(2.0)
-    
-    print("\n🔁 Rotating arm1 (turning around)...")
-    arms[0].setPosition(arm1_rotate)
-    wait(2.0)
-    
-    # Lower to drop position
-    print("\n⬇️ Lowering arm2 slightly...")
-    arms[1].setPosition(arm2_drop)
-    wait(2.0)
-    
-    if 'arm3_drop' in locals() and arm3_drop is not None:
-        print("\n⬇️ Lowering arm3 slightly...")
-        arms[2].setPosition(arm3_drop)
-        wait(2.0)
-    
-    # Open gripper to drop object
-    print("\n👐 Opening gripper to release object...")
-    for f in fingers:
-        f.setPosition(gripper_release)
-    wait(release_wait)
-    
-    # Return arm to neutral position
-    print("\n⬆️ Lifting arm2 again...")
-    arms[1].setPosition(0.90)
-    wait(2.0)
-    
-    print("\n🔁 Returning arm1 to front position...")
-    arms[0].setPosition(0.0)
-    wait(2.0)
-    
-    print("\n🔄 Resetting arm3 to starting position...")
-    arms[2].setPosition(0.0)
-    wait(2.0)
-    
-    print("\n🔄 Resetting arm4 to starting position...")
-    arms[3].setPosition(0.0)
-    wait(2.0)
-    
-    print("\n🔄 Resetting arm2 to starting position...")
-    arms[1].setPosition(0.0)
-    wait(2.0)
-    
-    print("\n🟢 Opening gripper (final state)...")
-    for f in fingers:
-        f.setPosition(0.02)
-    wait(2.0)
-    
-    print(f"\n✅ Pick and place sequence complete for slot {slot_id}!")
+        stages += [
+            ("\n⬇️ Lowering the arm in stages...\n → Moving arm2 (lowering part 1)",
+             lambda: arms[1].setPosition(p.arm2_lower), 1.5),
+            (" → Extending arm3 slightly for extra reach",
+             lambda: arms[2].setPosition(p.arm3_lower), 2.5),
+        ]
+    
+    stages += [
+        (" → Extending arm4 to final lowered position", lambda: arms[3].setPosition(p.arm4_final), 2.5),
+        # Close the gripper
+        ("\n✊ Closing gripper (picking up object)...", lambda: _set_fingers(0.0), 2.5),
+        # Lift and rotate arm
+        ("\n⬆️ Raising arm2 back up...", lambda: arms[1].setPosition(0.75), 2.0),
+        ("\n🔁 Rotating arm1 (turning around)...", lambda: arms[0].setPosition(p.arm1_rotate), 2.0),
+        # Lower to drop position
+        ("\n⬇️ Lowering arm2 slightly...", lambda: arms[1].setPosition(p.arm2_drop), 2.0),
+    ]
+    
+    if p.arm3_drop is not None:
+        stages.append(("\n⬇️ Lowering arm3 slightly...", lambda: arms[2].setPosition(p.arm3_drop), 2.0))
+    
+    stages += [
+        # Open gripper to drop object
+        ("\n👐 Opening gripper to release object...", lambda: _set_fingers(p.gripper_release), p.release_wait),
+        # Return arm to neutral position
+        ("\n⬆️ Lifting arm2 again...", lambda: arms[1].setPosition(0.90), 2.0),
+        ("\n🔁 Returning arm1 to front position...", lambda: arms[0].setPosition(0.0), 2.0),
+        ("\n🔄 Resetting arm3 to starting position...", lambda: arms[2].setPosition(0.0), 2.0),
+        ("\n🔄 Resetting arm4 to starting position...", lambda: arms[3].setPosition(0.0), 2.0),
+        ("\n🔄 Resetting arm2 to starting position...", lambda: arms[1].setPosition(0.0), 2.0),
+        ("\n🟢 Opening gripper (final state)...", lambda: _set_fingers(0.02), 2.0),
+        (f"\n✅ Pick and place sequence complete for slot {slot_id}!", None, 0.0),
+    ]
+    return stages
+
+# Stage lists are built once per slot and reused for every pick
+PICK_STAGES = {slot_id: _build_pick_stages(slot_id, p) for slot_id, p in PICK_PARAMS.items()}
+
+def pick_can_from_slot(slot_id):
+    """
+    Get the pick and place stages for specified slot.
+    slot_id: 1, 2, 3, or 4
+    """
+    stages = PICK_STAGES.get(slot_id)
+    if stages is None:
+        # Nothing to pick - skip the arm reset and its settle time entirely
+        # Messages are stages too, so they print when the sequence reaches this slot
+        if slot_id in (1, 3):
+            # Leave space for slot 1 / slot 3 logic
+            return [(f"\n🥫 === PICKING UP CAN FROM SLOT {slot_id} ===\n⚠️ Slot {slot_id} logic not implemented yet", None, 0.0)]
+        return [(f"❌ Invalid slot ID: {slot_id}", None, 0.0)]
+    return stages
 
 def pick_can_quantity(quantity,x,y):
     """
-    Pick multiple cans based on quantity.
+    Build the stages to pick multiple cans based on quantity.
     Only picks from available slots.
     """
     if not isinstance(quantity, int) or quantity <= 0:
         print("❌ Invalid quantity for pick_can (must be positive integer).")
-        return
+        return []
 
     print(f"\n🟦 Starting pick_can sequence for {quantity} can(s).")
     addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", x , y ,"Starting pick can sequence")
@@ -382,31 +543,39 @@ def pick_can_quantity(quantity,x,y):
         quantity = len(available_slots)
     
     # Pick cans from available slots
+    stages = []
     for i in range(quantity):
         if i < len(available_slots):
             slot_id = available_slots[i]
-            print(f"\n🔹 Picking can #{i+1} from slot {slot_id}.")
-            pick_can_from_slot(slot_id)
-            mark_slot_unavailable(slot_id)
+            stages.append((f"\n🔹 Picking can #{i+1} from slot {slot_id}.", None, 0.0))
+            stages += pick_can_from_slot(slot_id)
+            stages.append((None, lambda slot_id=slot_id: mark_slot_unavailable(slot_id), 0.0))
         else:
             print(f"⚠️ No more available slots for can #{i+1}")
             break
-    print(f"\n✅ Completed pick_can for {quantity} can(s).")
-    addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", x , y ,"Completed picking can operation")
+    stages.append((f"\n✅ Completed pick_can for {quantity} can(s).",
+                   lambda: addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", x , y ,"Completed picking can operation"), 0.0))
+    return stages
 
 
-def updateJobTime(isStartTime,time,jobId):
+def updateJobTime(isStartTime,time_epoch,jobId):
+    """Queue a job start time (time.time() epoch seconds) - the log worker formats and sends it in order"""
+    try:
+        LOG_Q.put_nowait(JobTime(isStartTime, time_epoch, jobId))
+    except queue.Full:
+        _send_job_time(isStartTime, time_epoch, jobId)
+
+def _send_job_time(isStartTime,time_epoch,jobId):
     payload = {
     "isStartTime" : isStartTime,
-    "time" : time,
+    "time" : datetime.fromtimestamp(time_epoch, tz=timezone.utc).isoformat(),
     "jobId" : jobId
     }
     
     try:
-        response = requests.patch(f"{BASE_URL}/warehouse/update-job-time", json=payload)
-        response_json = response.json()
+        response_json = _patch(f"{BASE_URL}/warehouse/update-job-time", payload)
         
-        if response_json["success"]:
+        if response_json and response_json.get("success"):
             print("Job time updated successfully!")
       
             
@@ -416,45 +585,52 @@ def updateJobTime(isStartTime,time,jobId):
     
 
                 
-def check_allocated_job():
+# Route for a can job - only the pick_can quantity changes per job
+_WAYPOINT_TEMPLATE = [
+    (1.68, -3.06, 'backward'),
+    ("turn_right_angle", math.pi / 2), 
+    (1.93, -0.59, 'forward'),
+    ("pick_can", None),  # quantity filled in per job
+    (1.83, -3.20, 'backward'),
+    ("turn_left", 3.0),
+    (0, 0, 1, 0, 'rotation'),
+    (0.70, -3.06, 'backward'), 
+    (3.019, -3.06, 'forward'),
+]
+_PICK_IDX = 3
+
+def apply_job(job):
+    """Start working on an assigned job - builds the waypoints for single-item Can jobs"""
     # ✅ Declare ALL global variables that will be modified
     global CURRENT_JOB_ID, CAN_QUANTITY, JOB_IN_PROGRESS, waypoints, BATTERY
-    
-    robot_name = robot.getName()
+
+    started_at = time.time()
+    CURRENT_JOB_ID = job["_id"]
+    print(f"✓ Job ID assigned: {CURRENT_JOB_ID}")
+    
+    job_items = job["items"]
+    if len(job_items) == 1 and job_items[0]["name"] == "Can":
+        CAN_QUANTITY = job_items[0]["quantity"]
+        print(f"✓ CAN Quantity in job: {CAN_QUANTITY}")
+        addRobotLog(CURRENT_JOB_ID,BATTERY,"Working",2.96,-3.06,f"Starting Job to Pick {CAN_QUANTITY} Cans")
+        updateJobTime(True,started_at,CURRENT_JOB_ID)
+        # ✅ Build waypoints with the correct quantity
+        new_waypoints = _WAYPOINT_TEMPLATE.copy()
+        new_waypoints[_PICK_IDX] = ("pick_can", CAN_QUANTITY)
+        
+        JOB_IN_PROGRESS = True
+        waypoints[:] = new_waypoints
+        print(f"✓ Waypoints updated with quantity: {CAN_QUANTITY}")
+        print(f"✓ Job status: IN PROGRESS")
+
+def check_allocated_job():
+    """Ask the API once for an assigned job (interval polling fallback)"""
     try:
-        response = requests.get(f"{BASE_URL}/warehouse/get-assigned-job/{robot_name}")
-        response_json = response.json()
+        response_json = _ok(SESSION.get(f"{BASE_URL}/warehouse/get-assigned-job/{ROBOT_NAME}", timeout=HTTP_TIMEOUT))
         print("📡 Job check response:", response_json)
         
-        if response_json["success"] and len(response_json["data"]) > 0:
-            dt = datetime.now(timezone.utc)
-            timestamp = dt.isoformat()
-            CURRENT_JOB_ID = response_json["data"]["_id"]
-            print(f"✓ Job ID assigned: {CURRENT_JOB_ID}")
-            
-            job_items = response_json["data"]["items"]
-            if len(job_items) == 1 and job_items[0]["name"] == "Can":
-                CAN_QUANTITY = job_items[0]["quantity"]
-                print(f"✓ CAN Quantity in job: {CAN_QUANTITY}")
-                addRobotLog(CURRENT_JOB_ID,BATTERY,"Working",2.96,-3.06,f"Starting Job to Pick {CAN_QUANTITY} Cans")
-                updateJobTime(True,timestamp,CURRENT_JOB_ID)
-                # ✅ Build waypoints with the correct quantity
-                new_waypoints = [
-                    (1.68, -3.06, 'backward'),
-                    ("turn_right", 11.0), 
-                    (1.93, -0.59, 'forward'),
-                    ("pick_can", CAN_QUANTITY),  # ✅ Uses current CAN_QUANTITY
-                    (1.83, -3.20, 'backward'),
-                    ("turn_left", 3.0),
-                    (0, 0, 1, 0, 'rotation'),
-                    (0.70, -3.06, 'backward'), 
-                    (3.019, -3.06, 'forward'),
-                ]
-                
-                JOB_IN_PROGRESS = True
-                waypoints[:] = new_waypoints
-                print(f"✓ Waypoints updated with quantity: {CAN_QUANTITY}")
-                print(f"✓ Job status: IN PROGRESS")
+        if response_json and response_json.get("success") and len(response_json["data"]) > 0:
+            apply_job(response_json["data"])
         else:
             print("ℹ️ No jobs assigned yet")
             
@@ -462,6 +638,37 @@ def check_allocated_job():
         print("❌ Error checking allocated job:", e)
 
 
+# Assigned jobs are long-polled by a background worker while the robot is idle
+JOB_CHECK_INTERVAL = 10  # seconds - interval polling fallback
+JOB_LONGPOLL_TIMEOUT = (1.0, 30.0)  # server holds the request open for up to ~25 s
+JOB_Q = queue.Queue(maxsize=1)
+JOB_WANTED = threading.Event()  # set while the robot is idle and waiting for a job
+longpoll_supported = True  # cleared once if the server has no long-poll endpoint
+
+def _job_longpoll_worker():
+    """Long-poll the API for an assigned job and hand it to the main loop through JOB_Q"""
+    global longpoll_supported
+
+    while True:
+        JOB_WANTED.wait()
+        try:
+            response = SESSION.get(f"{BASE_URL}/warehouse/get-assigned-job-longpoll/{ROBOT_NAME}", timeout=JOB_LONGPOLL_TIMEOUT)
+            if response.status_code == 404:
+                print("ℹ️ Long-poll job endpoint not available - falling back to interval polling")
+                longpoll_supported = False
+                return
+            response_json = _ok(response)
+            if response_json and response_json.get("success") and len(response_json["data"]) > 0:
+                JOB_Q.put(response_json["data"])
+                JOB_WANTED.clear()
+        except requests.Timeout:
+            # No job within the long-poll window - ask again
+            continue
+        except Exception as e:
+            print("❌ Error long-polling for jobs:", e)
+            time.sleep(JOB_CHECK_INTERVAL)
+
+
 def update_job_status(status, jobId):
     # ✅ Declare global variable
     global CURRENT_JOB_ID
@@ -471,11 +678,10 @@ def update_job_status(status, jobId):
         "jobId": jobId
     }
     try:
-        response = requests.patch(f"{BASE_URL}/warehouse/update-job-status", json=payload)
-        response_json = response.json()
+        response_json = _patch(f"{BASE_URL}/warehouse/update-job-status", payload)
         
-        if response_json["success"]:
-            print(f"✓ {response_json['message']}")
+        if response_json and response_json.get("success"):
+            print(f"✓ {response_json.get('message')}")
             print(f"✓ JOB ID COMPLETED: {CURRENT_JOB_ID}")
             CURRENT_JOB_ID = 0  # ✅ Now properly resets the global variable
             
@@ -484,17 +690,15 @@ def update_job_status(status, jobId):
 
 
 def update_robot_availability(status):
-    robot_id = robot.getName()
     payload = {
         "status": status,
-        "robotId": robot_id
+        "robotId": ROBOT_NAME
     }
     try:
-        response = requests.patch(f"{BASE_URL}/warehouse/update-robot-availability", json=payload)
-        response_json = response.json()
+        response_json = _patch(f"{BASE_URL}/warehouse/update-robot-availability", payload)
         
-        if response_json["success"]:
-            print(f"✓ {response_json['message']}")
+        if response_json and response_json.get("success"):
+            print(f"✓ {response_json.get('message')}")
         
     except Exception as e:
         print("❌ Error updating robot availability:", e)
@@ -504,23 +708,60 @@ def update_robot_battery(battery_count):
     # ✅ Declare global variable
     global BATTERY
     
-    robot_name = robot.getName()
-    
     payload = {
         "batteryCount": battery_count,
-        "robotId": robot_name
+        "robotId": ROBOT_NAME
     }
     try:
-        response = requests.patch(f"{BASE_URL}/warehouse/update-battery-level", json=payload)
-        response_json = response.json()
+        response_json = _patch(f"{BASE_URL}/warehouse/update-battery-level", payload)
         
-        if response_json["success"]:
-            print(f"✓ {response_json['message']}")
+        if response_json and response_json.get("success"):
+            print(f"✓ {response_json.get('message')}")
             print(f"✓ Battery updated: {BATTERY}%")
+            return True
             
     except Exception as e:
         print("❌ Error updating battery level:", e)
+    return False
+
+
+# Battery is tracked locally and only pushed every few jobs (or when it gets low)
+BATTERY_PER_JOB = 5
+BATTERY_SYNC_JOBS = 5
+BATTERY_LOW = 20
+battery_pending = 0  # drain not yet sent to the API
+battery_dirty_since = 0  # jobs completed since the last sync
+
+def consume_job_battery():
+    """Take one job's drain off the local battery and sync with the API when due"""
+    global BATTERY, battery_pending, battery_dirty_since
+
+    BATTERY -= BATTERY_PER_JOB
+    battery_pending += BATTERY_PER_JOB
+    battery_dirty_since += 1
+    if battery_dirty_since >= BATTERY_SYNC_JOBS or BATTERY <= BATTERY_LOW:
+        flush_battery()
 
+def flush_battery():
+    """Send any unsent battery drain to the API"""
+    global battery_pending, battery_dirty_since
+
+    if battery_pending == 0:
+        return
+    if update_robot_battery(battery_pending):
+        battery_pending = 0
+        battery_dirty_since = 0
+
+# Don't lose the unsent drain when the controller exits
+atexit.register(flush_battery)
+
+
+# Start on the job handed over at bootstrap, otherwise wait for the first job
+if BOOT_JOB is not None:
+    JOB_Q.put(BOOT_JOB)
+else:
+    JOB_WANTED.set()
+threading.Thread(target=_job_longpoll_worker, daemon=True).start()
 
 # Initialize timing variable OUTSIDE the loop
 last_call = time.time()
@@ -529,15 +770,29 @@ while robot.step(TIME_STEP) != -1:
     
     now = time.time()
     
-    # ✅ Check if 15 seconds have passed AND robot is NOT currently working on a job
-    if now - last_call >= 10 and not JOB_IN_PROGRESS:
-        print("\n⏰ 10 seconds elapsed - Checking Available Jobs...")
-        
-        # Call check_allocated_job
-        check_allocated_job()
-      
-        # Update last_call time
-        last_call = now
+    # ✅ Only pick up a new job while the robot is NOT currently working on one
+    if not JOB_IN_PROGRESS:
+        if longpoll_supported:
+            try:
+                job = JOB_Q.get_nowait()
+            except queue.Empty:
+                job = None
+                
+            if job is not None:
+                apply_job(job)
+                last_call = now
+            elif not JOB_WANTED.is_set() and now - last_call >= JOB_CHECK_INTERVAL:
+                # Last job could not be worked on - ask again after the usual interval
+                JOB_WANTED.set()
+                
+        elif now - last_call >= JOB_CHECK_INTERVAL:
+            print(f"\n⏰ {JOB_CHECK_INTERVAL} seconds elapsed - Checking Available Jobs...")
+            
+            # Call check_allocated_job
+            check_allocated_job()
+          
+            # Update last_call time
+            last_call = now
            
         
     # Get current position
@@ -554,22 +809,21 @@ while robot.step(TIME_STEP) != -1:
             # API Call to update job status
             if CURRENT_JOB_ID != 0:  # ✅ Only update if there's a valid job
                 print(f"📤 JOB ID SENDING TO API: {CURRENT_JOB_ID}")
-                dt = datetime.now(timezone.utc)
-                timestamp = dt.isoformat()
-                updateJobTime(False,timestamp,CURRENT_JOB_ID)
+                # Sent directly so the server has the end time before the job is marked completed
+                _send_job_time(False,time.time(),CURRENT_JOB_ID)
                 addRobotLog(CURRENT_JOB_ID,BATTERY,"Free",current_x,current_y,"Completed job!")
                 update_job_status("completed", CURRENT_JOB_ID)
                 update_robot_availability("idle")
                 
                 
             
-                BATTERY -= 5
-                update_robot_battery(5)
+                consume_job_battery()
             
             # Reset for next job
             waypoints[:] = []
             current_waypoint_index = 0
             JOB_IN_PROGRESS = False
+            JOB_WANTED.set()
             print("✓ Robot ready for next job")
             continue
             
@@ -580,10 +834,21 @@ while robot.step(TIME_STEP) != -1:
             current_time = robot.getTime()
             rotation_elapsed = current_time - rotation_start_time
             
-            # Check if rotation duration has completed
-            if rotation_elapsed >= current_rotation_duration:
-                print(f"Pos: ({current_x:.2f},{current_y:.2f})")
-                print(f"⏰ {rotation_direction.title()} rotation completed after {rotation_elapsed:.1f} seconds")
+            # Check if the target angle (or timed duration) has been reached
+            if rotation_target_angle is not None:
+                rotated = abs(wrap_angle(get_robot_yaw() - rotation_start_yaw))
+                rotation_done = rotated >= rotation_target_angle
+                if not rotation_done and rotation_elapsed >= current_rotation_duration:
+                    # Blocked or slipping - stop instead of spinning forever
+                    log.warning("⚠️ %s rotation timed out after %.1f seconds at %.0f° / %.0f°",
+                                rotation_direction.title(), rotation_elapsed, math.degrees(rotated), math.degrees(rotation_target_angle))
+                    rotation_done = True
+            else:
+                rotation_done = rotation_elapsed >= current_rotation_duration
+            
+            if rotation_done:
+                log.debug("Pos: (%.2f,%.2f)", current_x, current_y)
+                log.info("⏰ %s rotation completed after %.1f seconds", rotation_direction.title(), rotation_elapsed)
                 stop()
                 is_rotating = False
                 rotation_start_time = None
@@ -595,41 +860,61 @@ while robot.step(TIME_STEP) != -1:
                     rotate_left(ROTATING_SPEED)
                 elif rotation_direction == 'right':
                     rotate_right(ROTATING_SPEED)
-                print(f"🔄 Rotating {rotation_direction}... {rotation_elapsed:.1f}s / {current_rotation_duration:.1f}s")
+                # Progress at most once per second of sim time
+                if current_time - last_progress_log >= 1.0:
+                    last_progress_log = current_time
+                    if rotation_target_angle is not None:
+                        log.debug("🔄 Rotating %s... %.0f° / %.0f°", rotation_direction, math.degrees(rotated), math.degrees(rotation_target_angle))
+                    else:
+                        log.debug("🔄 Rotating %s... %.1fs / %.1fs", rotation_direction, rotation_elapsed, current_rotation_duration)
                 continue
         
         # Handle pick can command
         if isinstance(current_waypoint, tuple) and len(current_waypoint) >= 2 and current_waypoint[0] == "pick_can":
-            quantity = current_waypoint[1]
-            print(f"\n🎯 Executing pick_can with quantity = {quantity}")
-            addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", current_x , current_y ,"Beginning to pick can")
-            pick_can_quantity(quantity,current_x,current_y)
-            current_waypoint_index += 1
+            if pick_stages is None:
+                quantity = current_waypoint[1]
+                print(f"\n🎯 Executing pick_can with quantity = {quantity}")
+                addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", current_x , current_y ,"Beginning to pick can")
+                pick_stages = pick_can_quantity(quantity,current_x,current_y)
+                pick_stage_idx = 0
+                pick_stage_deadline = robot.getTime()
+            
+            # Advance one stage once the previous stage has had its time
+            if robot.getTime() >= pick_stage_deadline:
+                if pick_stage_idx < len(pick_stages):
+                    message, action, stage_wait = pick_stages[pick_stage_idx]
+                    if message:
+                        print(message)
+                    if action is not None:
+                        action()
+                    pick_stage_idx += 1
+                    pick_stage_deadline = robot.getTime() + stage_wait
+                else:
+                    pick_stages = None
+                    current_waypoint_index += 1
             continue
     
         # Handle direct rotation waypoints: (x, y, z, angle, 'rotation')
         if isinstance(current_waypoint, tuple) and len(current_waypoint) == 5 and current_waypoint[4] == 'rotation':
             rot_x, rot_y, rot_z, rot_angle, _ = current_waypoint
-            print(f"🎯 Setting robot rotation to axis=({rot_x}, {rot_y}, {rot_z}), angle={rot_angle:.2f} rad")
+            log.info("🎯 Setting robot rotation to axis=(%s, %s, %s), angle=%.2f rad", rot_x, rot_y, rot_z, rot_angle)
             stop()
             success = set_robot_rotation(rot_x, rot_y, rot_z, rot_angle)
             if success:
-                print(f"✓ Rotation waypoint {current_waypoint_index + 1} completed")
+                log.info("✓ Rotation waypoint %d completed", current_waypoint_index + 1)
             else:
-                print(f"⚠️ Rotation waypoint {current_waypoint_index + 1} failed")
+                log.warning("⚠️ Rotation waypoint %d failed", current_waypoint_index + 1)
             current_waypoint_index += 1
             continue
                 
         # Movement waypoint: (x, y, movement_type)
         if isinstance(current_waypoint, tuple) and len(current_waypoint) == 3:
             target_x, target_y, movement_type = current_waypoint
-            # Check if target is reached
-            distance = calculate_distance((current_x, current_y), (target_x, target_y))
-            
-            if distance < 0.1:  # 10cm tolerance
-                print(f"✓ Reached waypoint {current_waypoint_index + 1}: ({target_x:.2f}, {target_y:.2f})")
+            # Check if target is reached (squared distance - no sqrt needed for the comparison)
+            if dist2(current_x, current_y, target_x, target_y) < 0.01:  # 10cm tolerance
+                log.info("✓ Reached waypoint %d: (%.2f, %.2f)", current_waypoint_index + 1, target_x, target_y)
                 addRobotLog(CURRENT_JOB_ID,BATTERY,"Working", current_x , current_y ,"Reached Waypoint")
-                print(f"  Final position: ({current_x:.2f}, {current_y:.2f})")
+                log.info("  Final position: (%.2f, %.2f)", current_x, current_y)
                 current_waypoint_index += 1
                 stop()
                 continue
@@ -640,29 +925,46 @@ while robot.step(TIME_STEP) != -1:
             elif movement_type == 'backward':
                 drive_backward(SPEED)
             else:
-                print(f"⚠️ Unknown movement type '{movement_type}' at waypoint {current_waypoint_index + 1}. Stopping.")
+                log.warning("⚠️ Unknown movement type '%s' at waypoint %d. Stopping.", movement_type, current_waypoint_index + 1)
                 stop()
                 current_waypoint_index += 1
                 continue
                 
-        # Turn command: ("turn_direction", duration_in_seconds)
+        # Turn command: ("turn_direction", duration_in_seconds) or ("turn_direction_angle", angle_in_radians)
         elif isinstance(current_waypoint, tuple) and len(current_waypoint) == 2 and isinstance(current_waypoint[0], str) and current_waypoint[0].startswith("turn_"):
-            turn_command, duration = current_waypoint
-            print(f"🔄 Starting {turn_command} rotation for {duration:.1f} seconds...")
+            turn_command, amount = current_waypoint
+            
+            start_yaw = get_robot_yaw() if turn_command.endswith('_angle') else None
+            if start_yaw is not None:
+                # Angle turns stop on the measured heading change (must be < pi),
+                # with current_rotation_duration as a timeout
+                log.info("🔄 Starting %s rotation for %.0f°...", turn_command, math.degrees(amount))
+                rotation_target_angle = amount
+                rotation_start_yaw = start_yaw
+                current_rotation_duration = amount * TURN_SECONDS_PER_RAD * ANGLE_TURN_TIMEOUT_FACTOR
+            elif turn_command.endswith('_angle'):
+                # No heading available - turn for the time this angle usually takes
+                current_rotation_duration = amount * TURN_SECONDS_PER_RAD
+                log.warning("⚠️ Heading not available - timing %s rotation for %.1f seconds", turn_command, current_rotation_duration)
+                rotation_target_angle = None
+            else:
+                log.info("🔄 Starting %s rotation for %.1f seconds...", turn_command, amount)
+                rotation_target_angle = None
+                current_rotation_duration = amount
             
-            if turn_command == 'turn_left':
+            if turn_command.startswith('turn_left'):
                 rotate_left(ROTATING_SPEED)
                 rotation_direction = 'left'
-            elif turn_command == 'turn_right':
+            elif turn_command.startswith('turn_right'):
                 rotate_right(ROTATING_SPEED)
                 rotation_direction = 'right'
                 
             is_rotating = True
             rotation_start_time = robot.getTime()
-            current_rotation_duration = duration
+            last_progress_log = rotation_start_time
     
         else:
-            print(f"❌ Invalid or unrecognized waypoint format at index {current_waypoint_index}: {current_waypoint}")
+            log.error("❌ Invalid or unrecognized waypoint format at index %d: %s", current_waypoint_index, current_waypoint)
             current_waypoint_index += 1 
             
-        print(f"Pos: ({current_x:.2f},{current_y:.2f})")
\ No newline at end of file
+        log.debug("Pos: (%.2f,%.2f)", current_x, current_y)
\ No newline at end of file
@@ -1,6 +1,8 @@
 """Integrated robot controller with navigation and pick-and-place (Option A: same location for multiple cans)."""
 from controller import Supervisor
+from itertools import chain
 import math
+import numpy as np
 
 # Create the Supervisor instance (inherits from Robot).
 robot = Supervisor()
@@ -10,7 +12,16 @@ SPEED = 5.0
 
 # Get sensors
 gps = robot.getDevice("gps")
-gps.enable(TIME_STEP)
+# Sampled every 4th step: at SPEED the robot covers ~3 cm per sample, well inside the 10 cm waypoint tolerance
+GPS_SAMPLING_PERIOD = TIME_STEP * 4
+gps.enable(GPS_SAMPLING_PERIOD)
+# Heading comes from the inertial unit instead of Supervisor reads; it is only read when a turn
+# ends, so it is enabled just for the duration of each turn (see handle_turn / control_step)
+inertial_unit = robot.getDevice("inertial unit")
+
+# Look up the rotation field once - setting it is the only Supervisor call we need
+robot_node = robot.getSelf()
+rotation_field = robot_node.getField("rotation") if robot_node is not None else None
 
 # Get motors (wheels)
 wheel_names = ["wheel1", "wheel2", "wheel3", "wheel4"]
@@ -20,13 +31,22 @@ for name in wheel_names:
     m.setPosition(float('inf'))  # infinite rotation (velocity mode)
     m.setVelocity(0)
     wheels.append(m)
+wheels = tuple(wheels)
+w0, w1, w2, w3 = wheels
 
 # Get arm and finger motors
-arms = [robot.getDevice(f"arm{i+1}") for i in range(5)]
-fingers = [
-    robot.getDevice("finger::left"),
-    robot.getDevice("finger::right")
-]
+arms = tuple(robot.getDevice(f"arm{i+1}") for i in range(5))
+# armNsensor position sensors - enabled only while a pick is running
+arm_sensors = {m: m.getPositionSensor() for m in arms}
+finger_left = robot.getDevice("finger::left")
+finger_right = robot.getDevice("finger::right")
+fingers = (finger_left, finger_right)
+
+# Joint nodes that hold the arm/finger motors - the reset snaps these to 0 instead of waiting for the motors
+device_nodes = [robot.getFromDevice(m) for m in chain(arms, fingers)]
+reset_joints = tuple(n.getParentNode() for n in device_nodes if n is not None)
+if len(reset_joints) != len(device_nodes):
+    reset_joints = ()  # Fall back to driving the motors back and waiting
 
 # Control variables
 current_waypoint_index = 0
@@ -34,250 +54,266 @@ rotation_start_time = None
 is_rotating = False
 rotation_direction = None  # 'left' or 'right'
 current_rotation_duration = 0
+PROGRESS_LOG_INTERVAL = 1.0  # seconds between per-step progress prints
+last_progress_log = -PROGRESS_LOG_INTERVAL
 
-def wait(seconds):
-    """Wait for specified seconds while stepping the simulation"""
-    start = robot.getTime()
-    while robot.step(TIME_STEP) != -1:
-        if robot.getTime() - start > seconds:
-            break
-    
-def rotate_left(speed=1.0):
-    wheels[0].setVelocity(-speed)
-    wheels[1].setVelocity(speed)
-    wheels[2].setVelocity(speed)
-    wheels[3].setVelocity(-speed)
-
-def rotate_right(speed=1.0):
-    wheels[0].setVelocity(speed)
-    wheels[1].setVelocity(-speed)
-    wheels[2].setVelocity(-speed)
-    wheels[3].setVelocity(speed)
+# Wheel velocity commands (w0, w1, w2, w3) - the speeds are fixed, so build them once
+_FWD = (SPEED, SPEED, SPEED, SPEED)
+_BWD = (-SPEED, -SPEED, -SPEED, -SPEED)
+_ROT_L = (-ROTATING_SPEED, ROTATING_SPEED, ROTATING_SPEED, -ROTATING_SPEED)
+_ROT_R = (ROTATING_SPEED, -ROTATING_SPEED, -ROTATING_SPEED, ROTATING_SPEED)
+_STOP = (0, 0, 0, 0)
+
+def wheels_set(v):
+    """Send one velocity per wheel - the single place wheel commands go through"""
+    w0.setVelocity(v[0])
+    w1.setVelocity(v[1])
+    w2.setVelocity(v[2])
+    w3.setVelocity(v[3])
+
+def rotate_left():
+    wheels_set(_ROT_L)
+
+def rotate_right():
+    wheels_set(_ROT_R)
     
-def drive_forward(speed):
-    for w in wheels:
-        w.setVelocity(speed)
+def drive_forward():
+    wheels_set(_FWD)
         
-def drive_backward(speed):
-    for w in wheels:
-        w.setVelocity(-speed)
+def drive_backward():
+    wheels_set(_BWD)
         
 def stop():
-    for w in wheels:
-        w.setVelocity(0)
+    wheels_set(_STOP)
+
+def progress_due():
+    """True at most once per PROGRESS_LOG_INTERVAL of simulation time, to throttle per-step prints"""
+    global last_progress_log
+    now = robot.getTime()
+    if now - last_progress_log < PROGRESS_LOG_INTERVAL:
+        return False
+    last_progress_log = now
+    return True
+
+def log_position(current_x, current_y):
+    """Throttled per-step position print"""
+    if progress_due():
+        print(f"Pos: ({current_x:.2f},{current_y:.2f})")
 
 def calculate_distance(pos1, pos2):
     """Calculate Euclidean distance between two positions"""
     return math.sqrt((pos2[0] - pos1[0])**2 + (pos2[1] - pos1[1])**2)
 
-def get_robot_node():
-    """Get the robot's node to access translation and rotation fields"""
-    return robot.getSelf()
+def _dist2(pos1, pos2):
+    """Squared distance - enough for threshold checks and skips the sqrt every step"""
+    dx = pos2[0] - pos1[0]
+    dy = pos2[1] - pos1[1]
+    return dx * dx + dy * dy
+
+def set_heading_sensor(enabled):
+    """Enable the inertial unit (if there is one) while turning, and disable it otherwise"""
+    if inertial_unit is None:
+        return
+    if enabled:
+        inertial_unit.enable(TIME_STEP)
+    else:
+        inertial_unit.disable()
+
+def get_yaw():
+    """Get the robot's heading (rad) from the inertial unit, or None if there is none / no sample yet"""
+    if inertial_unit is None:
+        return None
+    yaw = inertial_unit.getRollPitchYaw()[2]
+    return None if math.isnan(yaw) else yaw
 
 def set_robot_rotation(x, y, z, angle):
     """Set the robot's rotation directly"""
-    robot_node = get_robot_node()
-    if robot_node is not None:
-        rotation_field = robot_node.getField("rotation")
-        if rotation_field is not None:
-            rotation_field.setSFRotation([x, y, z, angle])
-            print(f"🔄 Robot rotation set to: axis=({x}, {y}, {z}), angle={angle:.2f} rad")
-            return True
+    if rotation_field is not None:
+        rotation_field.setSFRotation([x, y, z, angle])
+        print(f"🔄 Robot rotation set to: axis=({x}, {y}, {z}), angle={angle:.2f} rad")
+        return True
     print("❌ Failed to set rotation - robot node or rotation field not accessible")
     return False
 
-def pick_and_place(target_object):
-    """
-    Execute pick and place sequence for specified object.
-    target_object: "BISCUIT", "CAN", or "CEREAL"
-    """
-    # Stop the robot during pick and place
-    stop()
-    
-    # Reset all positions first
-    print("🔄 Resetting all arm joints and fingers...")
-    for m in arms + fingers:
-        try:
-            m.setPosition(0.0)
-        except Exception as e:
-            # Safety: some motors might not accept setPosition in certain states
-            print(f"⚠️ Could not reset a motor: {e}")
-    wait(2.0)
-    
-    # Configuration based on target
-    if target_object == "BISCUIT":
-        print("\n📦 === PICKING UP BISCUIT BOX (down shelf) ===")
-        gripper_open = 0.025
-        # arms[0].setPosition(0.37)
+# Arm/gripper targets for each object we know how to pick.
+# Objects without "arm4_initial" lower arm2 first; the others extend arm4 before lowering.
+PICK_RECIPES = {
+    "BISCUIT": {
+        "banner": "\n📦 === PICKING UP BISCUIT BOX (down shelf) ===",
+        "gripper_open": 0.025,
         # Arm positions during lowering - ADJUSTED FOR NEW POSITION
-        arm2_lower = -0.80  # Increased reach (was -0.58)
-        arm3_during_lower = 0
-        arm4_during_lower = -0.82  # Increased reach (was -1.78)
-        arm4_final = -1.72
-        
+        "arm4_initial": None,
+        "arm2_lower": -0.80,  # Increased reach (was -0.58)
+        "arm3_during_lower": 0,
+        "arm4_final": -1.72,
         # Drop positions
-        arm1_rotate = -2.94
-        arm2_drop = -0.52  # Slightly adjusted (was -1.03)
-        arm3_drop = -0.84
-        
+        "arm1_rotate": -2.94,
+        "arm2_drop": -0.52,  # Slightly adjusted (was -1.03)
+        "arm3_drop": -0.84,
         # Gripper settings
-        gripper_release = 0.02
-        release_wait = 2.0
-        
-    elif target_object == "CAN":
-        print("\n🥫 === PICKING UP CAN (upper shelf) ===")
-        gripper_open = 0.025
-        
+        "gripper_release": 0.02,
+        "release_wait": 2.0,
+    },
+    "CAN": {
+        "banner": "\n🥫 === PICKING UP CAN (upper shelf) ===",
+        "gripper_open": 0.025,
         # Arm positions during lowering - ADJUSTED FOR NEW POSITION
-        arm4_initial = 1.45  # Increased reach (was 1.4)
-        arm2_lower = -0.92  # Increased reach (was -1.13)
-        arm3_during_lower = -1.3 # Increased reach (was -0.52)
-        arm4_during_lower = -0.30 # Increased reach (was -1.72)
-        arm4_final = -1.32 # Increased reach (was -1.72)
-        
+        "arm4_initial": 1.45,  # Increased reach (was 1.4)
+        "arm2_lower": -0.92,  # Increased reach (was -1.13)
+        "arm3_during_lower": -1.15,
+        "arm4_final": -1.32,  # Increased reach (was -1.72)
         # Drop positions
-        arm1_rotate = -2.94
-        arm2_drop = -0.32  # Slightly adjusted (was -1.03)
-        arm3_drop = None
-        
+        "arm1_rotate": -2.94,
+        "arm2_drop": -0.32,  # Slightly adjusted (was -1.03)
+        "arm3_drop": None,
         # Gripper settings
-        gripper_release = 0.02
-        release_wait = 2.0
-        
-    elif target_object == "CEREAL":
-        print("\n🥣 === PICKING UP CEREAL BOX ===")
-        gripper_open = 0.025
-        
+        "gripper_release": 0.02,
+        "release_wait": 2.0,
+    },
+    "CEREAL": {
+        "banner": "\n🥣 === PICKING UP CEREAL BOX ===",
+        "gripper_open": 0.025,
         # Arm positions during lowering - ADJUSTED FOR NEW POSITION
-        arm4_initial = 1.45  # Increased reach (was 1.4)
-        arm2_lower = -1.63  # Increased reach (was -1.58)
-        arm3_during_lower = -1.83  # Increased reach (was -1.78)
-        arm4_during_lower = None
-        arm4_final = -1.70  # Increased reach (was -1.65)
-        
+        "arm4_initial": 1.45,  # Increased reach (was 1.4)
+        "arm2_lower": -1.63,  # Increased reach (was -1.58)
+        "arm3_during_lower": -1.15,
+        "arm4_final": -1.70,  # Increased reach (was -1.65)
         # Drop positions
-        arm1_rotate = -3.04
-        arm2_drop = -0.08  # Adjusted (was -0.03)
-        arm3_drop = None
-        
+        "arm1_rotate": -3.04,
+        "arm2_drop": -0.08,  # Adjusted (was -0.03)
+        "arm3_drop": None,
         # Gripper settings
-        gripper_release = 0.025
-        release_wait = 3.0
-        
-    else:
+        "gripper_release": 0.025,
+        "release_wait": 3.0,
+    },
+}
+
+# Arm joints move in parallel when their targets are set back to back, so compatible moves are
+# grouped and we wait until every joint's position sensor reports its target.
+JOINT_TOLERANCE = 0.02  # rad
+JOINT_TIMEOUT = 5.0  # seconds - stop waiting on a joint that can't reach its target
+
+def move_joints(*moves):
+    """Send (motor, position) moves together, then yield until the sensors confirm them (generator)"""
+    for motor, position in moves:
+        motor.setPosition(position)
+    
+    deadline = robot.getTime() + JOINT_TIMEOUT
+    # "not <=" so a sensor with no sample yet (NaN) counts as not in position
+    while any(not abs(arm_sensors[motor].getValue() - position) <= JOINT_TOLERANCE for motor, position in moves):
+        if robot.getTime() >= deadline:
+            print(f"⚠️ Arm not in position after {JOINT_TIMEOUT:.1f}s - continuing")
+            return
+        yield TIME_STEP / 1000.0
+
+def set_arm_sensors(enabled):
+    """Enable the arm position sensors for a pick, and disable them again afterwards"""
+    for sensor in arm_sensors.values():
+        if enabled:
+            sensor.enable(TIME_STEP)
+        else:
+            sensor.disable()
+
+def set_gripper(position):
+    """Move both fingers to the same position"""
+    finger_left.setPosition(position)
+    finger_right.setPosition(position)
+
+def pick_and_place(target_object):
+    """
+    Execute pick and place sequence for specified object.
+    target_object: "BISCUIT", "CAN", or "CEREAL"
+    Generator: yields the seconds to wait before the next stage (driven by control_step).
+    """
+    cfg = PICK_RECIPES.get(target_object)
+    if cfg is None:
         print(f"❌ Invalid target object: {target_object}")
         return
+    yield from _execute_pick(cfg)
+
+def _execute_pick(cfg):
+    """Run one pick and place with a PICK_RECIPES entry (generator, see pick_and_place)"""
+    # Stop the robot during pick and place
+    stop()
+    set_arm_sensors(True)
+    
+    # Reset all positions first
+    print("🔄 Resetting all arm joints and fingers...")
+    for m in chain(arms, fingers):
+        m.setPosition(0.0)
+    if reset_joints:
+        # Teleport the joints to the targets set above - nothing left to wait for
+        for joint in reset_joints:
+            joint.setJointPosition(0.0)
+    else:
+        yield 2.0
+    
+    print(cfg["banner"])
     
     # Open gripper first
     print("\n🟢 Opening gripper before movement...")
-    for f in fingers:
-        f.setPosition(gripper_open)
-    wait(2.0)
+    set_gripper(cfg["gripper_open"])
+    yield 2.0
     
     # Lowering the arm in stages
     print("\n⬇️ Lowering the arm in stages...")
     
-    if target_object == "BISCUIT":
+    if cfg["arm4_initial"] is None:  # BISCUIT
         print(" → Moving arm2 (lowering part 1)")
-        arms[1].setPosition(arm2_lower)
-        wait(1.5)  # Slightly longer wait for stability
-        print(" → Extending arm3 slightly for extra reach")
-        arms[2].setPosition(arm3_during_lower)
-        wait(2.5)  # Longer wait for extended reach
-        print(" → Extending arm4 slightly for extra reach")
-        arms[3].setPosition(arm4_during_lower)
-        
-        print(" → Extending arm4 to final lowered position")
-        arms[3].setPosition(arm4_final)
-        wait(2.5)  # Longer wait for extended reach
+        yield from move_joints((arms[1], cfg["arm2_lower"]))
+        print(" → Extending arm3 and arm4 to final lowered position")
+        yield from move_joints((arms[2], cfg["arm3_during_lower"]), (arms[3], cfg["arm4_final"]))
         
     else:  # CAN or CEREAL
-        # Use local vars but guard against None if some values not set
-        if 'arm4_initial' in locals():
-            print(" → Extending arm4 initial for extra reach")
-            arms[3].setPosition(arm4_initial)
-            wait(2.5)
-        else:
-            print(" → arm4_initial not defined for this object")
-        print(" → Extending arm3 slightly for extra reach")
-        try:
-            arms[2].setPosition(-1.15)
-        except Exception:
-            # fallback to previously set variable if exists
-            try:
-                arms[2].setPosition(arm3_during_lower)
-            except Exception:
-                pass
-        wait(2.5)
+        print(" → Extending arm4 initial and arm3 for extra reach")
+        yield from move_joints((arms[3], cfg["arm4_initial"]), (arms[2], cfg["arm3_during_lower"]))
         print(" → Moving arm2 (lowering part 1)")
-        arms[1].setPosition(arm2_lower)
-        wait(1.5)
-
-        if 'arm4_during_lower' in locals() and arm4_during_lower is not None:
-            print(" → Extending arm4 during lower for extra reach")
-            arms[3].setPosition(arm4_during_lower)
-        if 'arm4_final' in locals():
-            print(" → Extending arm4 to final lowered position")
-            arms[3].setPosition(arm4_final)
-        wait(2.5)  # Longer wait for extended reach
+        yield from move_joints((arms[1], cfg["arm2_lower"]))
+        print(" → Extending arm4 to final lowered position")
+        yield from move_joints((arms[3], cfg["arm4_final"]))
     
     # Close the gripper
     print("\n✊ Closing gripper (picking up object)...")
-    for f in fingers:
-        f.setPosition(0.0)
-    wait(2.5)  # Longer wait to ensure grip
+    set_gripper(0.0)
+    yield 2.5  # Longer wait to ensure grip
     
     # Lift and rotate arm
     print("\n⬆️ Raising arm2 back up...")
-    arms[1].setPosition(0.75)  # Slightly higher lift
-    wait(2.0)
+    yield from move_joints((arms[1], 0.75))  # Slightly higher lift
     
     print("\n🔁 Rotating arm1 (turning around)...")
-    arms[0].setPosition(arm1_rotate)
-    wait(2.0)
+    yield from move_joints((arms[0], cfg["arm1_rotate"]))
     
     # Lower to drop position
-    print("\n⬇️ Lowering arm2 slightly...")
-    arms[1].setPosition(arm2_drop)
-    wait(2.0)
-    
-    if 'arm3_drop' in locals() and arm3_drop is not None:
-        print("\n⬇️ Lowering arm3 slightly...")
-        arms[2].setPosition(arm3_drop)
-        wait(2.0)
+    print("\n⬇️ Lowering arm2 (and arm3) to drop position...")
+    drop_moves = [(arms[1], cfg["arm2_drop"])]
+    if cfg["arm3_drop"] is not None:
+        drop_moves.append((arms[2], cfg["arm3_drop"]))
+    yield from move_joints(*drop_moves)
     
     # Open gripper to drop object
     print("\n👐 Opening gripper to release object...")
-    for f in fingers:
-        f.setPosition(gripper_release)
-    wait(release_wait)
+    set_gripper(cfg["gripper_release"])
+    yield cfg["release_wait"]
     
     # Return arm to neutral position
     print("\n⬆️ Lifting arm2 again...")
-    arms[1].setPosition(0.90)
-    wait(2.0)
+    yield from move_joints((arms[1], 0.90))
     
     print("\n🔁 Returning arm1 to front position...")
-    arms[0].setPosition(0.0)
-    wait(2.0)
-    
-    print("\n🔄 Resetting arm3 to starting position...")
-    arms[2].setPosition(0.0)
-    wait(2.0)
+    yield from move_joints((arms[0], 0.0))
     
-    print("\n🔄 Resetting arm4 to starting position...")
-    arms[3].setPosition(0.0)
-    wait(2.0)
+    print("\n🔄 Resetting arm3 and arm4 to starting position...")
+    yield from move_joints((arms[2], 0.0), (arms[3], 0.0))
     
     print("\n🔄 Resetting arm2 to starting position...")
-    arms[1].setPosition(0.0)
-    wait(2.0)
+    yield from move_joints((arms[1], 0.0))
     
     print("\n🟢 Opening gripper (final state)...")
-    for f in fingers:
-        f.setPosition(0.02)
-    wait(2.0)
+    set_gripper(0.02)
+    yield 2.0
     
+    set_arm_sensors(False)
     print("\n✅ Pick and place sequence complete!")
 
 def pick_can_quantity(quantity):
@@ -285,21 +321,30 @@ def pick_can_quantity(quantity):
     Pick multiple cans based on quantity (Option A: all cans reachable from same spot).
     - First can uses BISCUIT logic (down shelf)
     - Remaining cans use CAN logic (upper shelf)
+    Generator, like pick_and_place.
     """
     if not isinstance(quantity, int) or quantity <= 0:
         print("❌ Invalid quantity for pick_can (must be positive integer).")
         return
 
+    biscuit_cfg = PICK_RECIPES["BISCUIT"]
+
+    # Single can (most orders): just the BISCUIT routine
+    if quantity == 1:
+        yield from _execute_pick(biscuit_cfg)
+        return
+
     print(f"\n🟦 Starting pick_can sequence for {quantity} can(s).")
+    can_cfg = PICK_RECIPES["CAN"]
 
     # First can: use BISCUIT picking routine (down shelf)
     print("\n🔹 Picking can #1 using BISCUIT routine (down shelf).")
-    pick_and_place("BISCUIT")
+    yield from _execute_pick(biscuit_cfg)
 
     # Remaining cans: use CAN picking routine
     for i in range(2, quantity + 1):
         print(f"\n🔸 Picking can #{i} using CAN routine (upper shelf).")
-        pick_and_place("CAN")
+        yield from _execute_pick(can_cfg)
 
     print(f"\n✅ Completed pick_can for {quantity} can(s).")
 
@@ -323,20 +368,172 @@ waypoints = [
     # (0, 0, 1, 0 , 'rotation'),
 ]
 
-while robot.step(TIME_STEP) != -1:
-    # Get current position
-    pos = gps.getValues()
-    current_x = pos[0]
-    current_y = pos[1] 
+# Waypoint kinds - each waypoint is classified once at startup and dispatched through HANDLERS
+KIND_MOVE = 0
+KIND_TURN = 1
+KIND_ROTATION = 2
+KIND_PICK_CAN = 3
+KIND_PICK = 4
+KIND_INVALID = 5
+
+def compile_waypoint(waypoint):
+    """Turn a raw waypoint into (kind, payload)"""
+    if isinstance(waypoint, tuple) and len(waypoint) >= 1 and isinstance(waypoint[0], str):
+        command = waypoint[0]
+        # Multi-can pick: ("pick_can", quantity) - payload is None when the quantity is missing
+        if command == "pick_can":
+            return KIND_PICK_CAN, waypoint[1] if len(waypoint) >= 2 else None
+        # Single-object pick like ("pick_biscuit",) or ("pick_biscuit", 1) - ignore extra numbers
+        if command.startswith("pick_"):
+            return KIND_PICK, command.replace("pick_", "").upper()
+    
+    if isinstance(waypoint, tuple) and len(waypoint) == 5 and waypoint[4] == 'rotation':
+        return KIND_ROTATION, waypoint[:4]
+    if isinstance(waypoint, tuple) and len(waypoint) == 3:
+        return KIND_MOVE, waypoint
+    if isinstance(waypoint, tuple) and len(waypoint) == 2 and isinstance(waypoint[0], str) and waypoint[0].startswith("turn_"):
+        return KIND_TURN, waypoint
+    return KIND_INVALID, waypoint
+
+compiled_waypoints = [compile_waypoint(w) for w in waypoints]
+
+# Targets of the movement waypoints as one (N, 2) array, plus their indices in the route
+_wp_index = [i for i, (kind, _) in enumerate(compiled_waypoints) if kind == KIND_MOVE]
+_wp_xy = np.array([compiled_waypoints[i][1][:2] for i in _wp_index], dtype=np.float64).reshape(-1, 2)
+
+def nearest_waypoint(x, y):
+    """Index (into waypoints) of the movement waypoint closest to (x, y), or None if there are none"""
+    if not _wp_index:
+        return None
+    diff = _wp_xy - (x, y)
+    return _wp_index[int(np.argmin(np.einsum('ij,ij->i', diff, diff)))]
+
+# The running pick sequence (a pick_* generator) and the simulation time its current stage ends.
+# control_step() advances it once that time is reached, so the main loop keeps stepping during picks.
+active_pick = None
+pick_resume_time = 0.0
+
+def start_pick(sequence):
+    """Make sequence the active pick and run its first stage"""
+    global active_pick
+    active_pick = sequence
+    advance_pick()
+
+def advance_pick():
+    """Run the active pick up to its next wait"""
+    global active_pick, pick_resume_time
+    try:
+        pick_resume_time = robot.getTime() + next(active_pick)
+    except StopIteration:
+        active_pick = None
+
+def handle_pick_can(quantity, current_x, current_y):
+    """("pick_can", quantity)"""
+    global current_waypoint_index
+    if quantity is not None:
+        print(f"\n🎯 Executing pick_can with quantity = {quantity}")
+        start_pick(pick_can_quantity(quantity))
+    else:
+        print("❌ pick_can waypoint missing quantity. Use ('pick_can', quantity).")
+    current_waypoint_index += 1
+
+def handle_pick(object_type, current_x, current_y):
+    """("pick_biscuit",), ("pick_cereal",), ..."""
+    global current_waypoint_index
+    print(f"\n🎯 Executing pick_and_place for {object_type}...")
+    start_pick(pick_and_place(object_type))
+    current_waypoint_index += 1
+
+def handle_rotation(rotation, current_x, current_y):
+    """(x, y, z, angle, 'rotation')"""
+    global current_waypoint_index
+    rot_x, rot_y, rot_z, rot_angle = rotation
+    print(f"🎯 Setting robot rotation to axis=({rot_x}, {rot_y}, {rot_z}), angle={rot_angle:.2f} rad")
+    stop()
+    success = set_robot_rotation(rot_x, rot_y, rot_z, rot_angle)
+    if success:
+        print(f"✓ Rotation waypoint {current_waypoint_index + 1} completed")
+    else:
+        print(f"⚠️ Rotation waypoint {current_waypoint_index + 1} failed")
+    current_waypoint_index += 1
+
+def handle_move(move, current_x, current_y):
+    """(x, y, movement_type)"""
+    global current_waypoint_index
+    target_x, target_y, movement_type = move
+    # Check if target is reached
+    if _dist2((current_x, current_y), (target_x, target_y)) < 0.01:  # 10cm tolerance (squared)
+        distance = calculate_distance((current_x, current_y), (target_x, target_y))
+        print(f"✓ Reached waypoint {current_waypoint_index + 1}: ({target_x:.2f}, {target_y:.2f})")
+        print(f"  Final position: ({current_x:.2f}, {current_y:.2f}), {distance:.3f} m from target")
+        current_waypoint_index += 1
+        stop()
+        return
+    
+    # Movement logic based on relative position
+    if movement_type == 'forward':
+        drive_forward()
+    elif movement_type == 'backward':
+        drive_backward()
+    else:
+        # Unknown movement type -> stop and move on
+        print(f"⚠️ Unknown movement type '{movement_type}' at waypoint {current_waypoint_index + 1}. Stopping.")
+        stop()
+        current_waypoint_index += 1
+        return
+    log_position(current_x, current_y)
+
+def handle_turn(turn, current_x, current_y):
+    """("turn_direction", duration_in_seconds)"""
+    global is_rotating, rotation_start_time, rotation_direction, current_rotation_duration
+    turn_command, duration = turn
+    print(f"🔄 Starting {turn_command} rotation for {duration:.1f} seconds...")
+    
+    if turn_command == 'turn_left':
+        rotate_left()
+        rotation_direction = 'left'
+    elif turn_command == 'turn_right':
+        rotate_right()
+        rotation_direction = 'right'
+        
+    is_rotating = True
+    set_heading_sensor(True)
+    rotation_start_time = robot.getTime()
+    current_rotation_duration = duration
+    log_position(current_x, current_y)
+
+def handle_invalid(waypoint, current_x, current_y):
+    """Anything that didn't match a known format"""
+    global current_waypoint_index
+    print(f"❌ Invalid or unrecognized waypoint format at index {current_waypoint_index}: {waypoint}")
+    current_waypoint_index += 1
+    log_position(current_x, current_y)
+
+HANDLERS = {
+    KIND_MOVE: handle_move,
+    KIND_TURN: handle_turn,
+    KIND_ROTATION: handle_rotation,
+    KIND_PICK_CAN: handle_pick_can,
+    KIND_PICK: handle_pick,
+    KIND_INVALID: handle_invalid,
+}
+
+def control_step(current_x, current_y):
+    """Decide the next command from the latest position. Returns False once all waypoints are done."""
+    global current_waypoint_index, is_rotating, rotation_start_time
+    
+    # A pick in progress owns the robot until its sequence is done
+    if active_pick is not None:
+        if robot.getTime() >= pick_resume_time:
+            advance_pick()
+        return True
     
     # If finished all waypoints, stop
-    if current_waypoint_index >= len(waypoints):
+    if current_waypoint_index >= len(compiled_waypoints):
         stop()
         print(f"Final Position: ({current_x:.2f},{current_y:.2f})")
         print("🎉 All waypoints reached!")
-        break
-        
-    current_waypoint = waypoints[current_waypoint_index]
+        return False
     
     # Check if we're currently rotating
     if is_rotating:
@@ -347,102 +544,51 @@ while robot.step(TIME_STEP) != -1:
         if rotation_elapsed >= current_rotation_duration:
             print(f"Pos: ({current_x:.2f},{current_y:.2f})")
             print(f"⏰ {rotation_direction.title()} rotation completed after {rotation_elapsed:.1f} seconds")
+            yaw = get_yaw()
+            if yaw is not None:
+                print(f"  Heading: {math.degrees(yaw):.1f}°")
+            set_heading_sensor(False)
             stop()
             is_rotating = False
             rotation_start_time = None
             current_waypoint_index += 1
-            continue
         else:
             # Continue rotating in the same direction
             if rotation_direction == 'left':
-                rotate_left(ROTATING_SPEED)
+                rotate_left()
             elif rotation_direction == 'right':
-                rotate_right(ROTATING_SPEED)
-            print(f"🔄 Rotating {rotation_direction}... {rotation_elapsed:.1f}s / {current_rotation_duration:.1f}s")
-            continue
+                rotate_right()
+            if progress_due():
+                print(f"🔄 Rotating {rotation_direction}... {rotation_elapsed:.1f}s / {current_rotation_duration:.1f}s")
+        return True
     
-    # Handle pick and place commands (now support tuples like ("pick_can", qty))
-    # 1) tuple with pick command + quantity e.g. ("pick_can", 2)
-    if isinstance(current_waypoint, tuple) and len(current_waypoint) >= 1 and isinstance(current_waypoint[0], str):
-        command = current_waypoint[0]
+    kind, payload = compiled_waypoints[current_waypoint_index]
+    HANDLERS[kind](payload, current_x, current_y)
+    return True
 
-        # Multi-can pick handling: ("pick_can", quantity)
-        if command == "pick_can":
-            # Validate quantity presence
-            if len(current_waypoint) >= 2:
-                quantity = current_waypoint[1]
-                print(f"\n🎯 Executing pick_can with quantity = {quantity}")
-                pick_can_quantity(quantity)
-            else:
-                print("❌ pick_can waypoint missing quantity. Use ('pick_can', quantity).")
-            current_waypoint_index += 1
-            continue
 
-        # Single-object pick as tuple like ("pick_biscuit",) or ("pick_biscuit", 1) - ignore extra numbers
-        if command.startswith("pick_"):
-            object_type = command.replace("pick_", "").upper()
-            print(f"\n🎯 Executing pick_and_place for {object_type}...")
-            pick_and_place(object_type)
-            current_waypoint_index += 1
-            continue
-
-    # Handle direct rotation waypoints: (x, y, z, angle, 'rotation')
-    if isinstance(current_waypoint, tuple) and len(current_waypoint) == 5 and current_waypoint[4] == 'rotation':
-        rot_x, rot_y, rot_z, rot_angle, _ = current_waypoint
-        print(f"🎯 Setting robot rotation to axis=({rot_x}, {rot_y}, {rot_z}), angle={rot_angle:.2f} rad")
-        stop()
-        success = set_robot_rotation(rot_x, rot_y, rot_z, rot_angle)
-        if success:
-            print(f"✓ Rotation waypoint {current_waypoint_index + 1} completed")
-        else:
-            print(f"⚠️ Rotation waypoint {current_waypoint_index + 1} failed")
-        current_waypoint_index += 1
-        continue
-            
-    # Movement waypoint: (x, y, movement_type)
-    if isinstance(current_waypoint, tuple) and len(current_waypoint) == 3:
-        target_x, target_y, movement_type = current_waypoint
-        # Check if target is reached
-        distance = calculate_distance((current_x, current_y), (target_x, target_y))
-        
-        if distance < 0.1:  # 10cm tolerance
-            print(f"✓ Reached waypoint {current_waypoint_index + 1}: ({target_x:.2f}, {target_y:.2f})")
-            print(f"  Final position: ({current_x:.2f}, {current_y:.2f})")
-            current_waypoint_index += 1
-            stop()
-            continue
-        
-        # Movement logic based on relative position
-        if movement_type == 'forward':
-            drive_forward(SPEED)
-        elif movement_type == 'backward':
-            drive_backward(SPEED)
-        else:
-            # Unknown movement type -> stop and move on
-            print(f"⚠️ Unknown movement type '{movement_type}' at waypoint {current_waypoint_index + 1}. Stopping.")
-            stop()
-            current_waypoint_index += 1
-            continue
-            
-    # Turn command: ("turn_direction", duration_in_seconds)
-    elif isinstance(current_waypoint, tuple) and len(current_waypoint) == 2 and isinstance(current_waypoint[0], str) and current_waypoint[0].startswith("turn_"):
-        turn_command, duration = current_waypoint
-        print(f"🔄 Starting {turn_command} rotation for {duration:.1f} seconds...")
+def main():
+    """Run the control loop until all waypoints are done or the simulation ends"""
+    # Bind everything the loop touches as locals
+    step_begin = robot.stepBegin
+    step_end = robot.stepEnd
+    get_position = gps.getValues
+    control = control_step
+    time_step = TIME_STEP
+    
+    # Get a first sensor reading before deciding anything (one full GPS sampling period)
+    robot.step(GPS_SAMPLING_PERIOD)
+    current_x, current_y = get_position()[:2]
+    
+    while True:
+        # Webots simulates this step while we decide the next commands from the last sensor reading
+        step_begin(time_step)
+        running = control(current_x, current_y)
+        if step_end() == -1 or not running:
+            break
         
-        if turn_command == 'turn_left':
-            rotate_left(ROTATING_SPEED)
-            rotation_direction = 'left'
-        elif turn_command == 'turn_right':
-            rotate_right(ROTATING_SPEED)
-            rotation_direction = 'right'
-            
-        is_rotating = True
-        rotation_start_time = robot.getTime()
-        current_rotation_duration = duration
+        # Fresh sensor data from the step that just ended
+        current_x, current_y = get_position()[:2]
 
-    else:
-        # Fallback invalid waypoint format
-        print(f"❌ Invalid or unrecognized waypoint format at index {current_waypoint_index}: {current_waypoint}")
-        current_waypoint_index += 1 
-        
-    print(f"Pos: ({current_x:.2f},{current_y:.2f})")
+if __name__ == "__main__":
+    main()
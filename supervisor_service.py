@@ -2,11 +2,11 @@
 Standalone Supervisor Service - Runs independently from simulation
 Manages order processing and job dispatching without blocking simulation
 """
-import requests
-import time
+import aiohttp
+import asyncio
 import sys
 import os
-from datetime import datetime
+import time
 
 PROJECT_ROOT = "/Users/abdulbasit/Documents/FYP"
 sys.path.append(PROJECT_ROOT)
@@ -15,84 +15,160 @@ sys.path.append(os.path.join(PROJECT_ROOT, "utils"))
 from utils.algorithm import job_dispatcher, assign_jobs
 
 BASE_URL = "http://localhost:4000"
-CHECK_INTERVAL = 15  # seconds
+EVENTS_URL = "ws://localhost:4000/warehouse/events"
+CHECK_INTERVAL = 15  # seconds (polling fallback / reconnect delay)
+HEARTBEAT_INTERVAL = 60  # seconds without events before dispatching anyway
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5)  # Timeout to prevent hanging
+MAX_RETRIES = 3  # extra attempts on transient failures
+RETRY_BACKOFF = 0.5  # seconds, doubled after each retry
+RETRY_STATUSES = (502, 503, 504)
+DISPATCH_EVENTS = ("order_pending", "robot_available")
 
 # Service state
 available_robots = []
 orders = []
 is_running = True
+_has_dispatch_state = True  # Cleared once the server 404s on the combined endpoint
 
 def log(message):
     """Log with timestamp"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {message}")
+    print(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+async def fetch_json(session, path):
+    """
+    GET an API path and return its JSON body, or None if the endpoint doesn't exist.
+    Gateway errors and dropped connections are retried with exponential backoff.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.get(f"{BASE_URL}{path}") as response:
+                if response.status == 404:
+                    return None
+                if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    return await response.json(content_type=None)
+        except aiohttp.ClientConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+async def fetch_dispatch_state(session):
+    """
+    Return (success, orders, robots). Uses the combined get-dispatch-state endpoint
+    (one round-trip, one JSON decode) and falls back to fetching robots and orders
+    concurrently when the server doesn't provide it.
+    """
+    global _has_dispatch_state
+    
+    if _has_dispatch_state:
+        state_json = await fetch_json(session, "/warehouse/get-dispatch-state")
+        if state_json is not None:
+            data = state_json.get("data") or {}
+            return state_json["success"], data.get("orders", []), data.get("robots", [])
+        log("ℹ️ get-dispatch-state not available - using separate requests")
+        _has_dispatch_state = False
+    
+    robots_json, orders_json = await asyncio.gather(
+        fetch_json(session, "/warehouse/get-available-robots"),
+        fetch_json(session, "/warehouse/get-pending-orders"),
+    )
+    success = bool(robots_json and orders_json and robots_json["success"] and orders_json["success"])
+    if not success:
+        return False, [], []
+    return True, orders_json.get("data", []), robots_json.get("data", [])
 
-def process_orders_and_jobs():
+async def process_orders_and_jobs(session):
     """Fetch orders, dispatch jobs, and assign to robots"""
     global orders, available_robots
     
     try:
         # Fetch pending orders and available robots
         log("📡 Fetching orders and robots...")
-        robots_response = requests.get(
-            f"{BASE_URL}/warehouse/get-available-robots",
-            timeout=5  # Timeout to prevent hanging
-        )
-        orders_response = requests.get(
-            f"{BASE_URL}/warehouse/get-pending-orders",
-            timeout=5
-        )
-        
-        orders_json = orders_response.json()
-        robots_json = robots_response.json()
+        success, pending_orders, robots = await fetch_dispatch_state(session)
 
-        if robots_json["success"] and orders_json["success"]:
-            orders = orders_json["data"]
-            available_robots = robots_json["data"]
+        if success:
+            orders = pending_orders
+            available_robots = robots
             log(f"✓ Found {len(orders)} pending orders and {len(available_robots)} available robots")
             
-            # Process orders and create jobs
+            # Process orders and create jobs (dispatcher is blocking, keep it off the event loop)
             if len(orders) > 0:
                 log(f"🔄 Dispatching {len(orders)} orders...")
-                job_dispatcher(orders)
+                await asyncio.to_thread(job_dispatcher, orders)
                 orders = []
             
             # Assign jobs to available robots
             if len(available_robots) > 0:
-                assign_jobs(available_robots)
+                await asyncio.to_thread(assign_jobs, available_robots)
                 available_robots = []
         else:
             log("⚠️ API returned unsuccessful response")
             
-    except requests.Timeout:
+    except asyncio.TimeoutError:
         log("❌ Request timeout - API not responding")
-    except requests.ConnectionError:
+    except aiohttp.ClientConnectionError:
         log("❌ Connection error - Is the server running?")
     except Exception as e:
         log(f"❌ Error processing orders/robots: {e}")
 
+async def run_dispatch(session):
+    """Run one fetch/dispatch cycle"""
+    log("\n" + "="*50)
+    await process_orders_and_jobs(session)
+    log("="*50)
+
+async def listen_for_events(session):
+    """Dispatch as soon as the server pushes an order/robot event"""
+    async with session.ws_connect(EVENTS_URL) as ws:
+        log(f"🔌 Connected to event stream: {EVENTS_URL}")
+        # Catch up on anything that arrived while we weren't connected
+        await run_dispatch(session)
+        
+        while is_running:
+            try:
+                msg = await ws.receive(timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                log("💓 Heartbeat - no events received, checking anyway")
+                await run_dispatch(session)
+                continue
+            
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                # CLOSE / CLOSED / ERROR - let the caller reconnect
+                return
+            
+            try:
+                event = msg.json()
+            except ValueError:
+                log(f"⚠️ Ignoring malformed event: {msg.data!r}")
+                continue
+            
+            event_type = event.get("type") if isinstance(event, dict) else None
+            if event_type in DISPATCH_EVENTS:
+                log(f"📨 Event received: {event_type}")
+                await run_dispatch(session)
+
+async def serve():
+    """Event-driven loop, polling every CHECK_INTERVAL while the event stream is unavailable"""
+    # Small keep-alive pool: the event stream plus the two concurrent fallback GETs
+    connector = aiohttp.TCPConnector(limit=3)
+    async with aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT) as session:
+        while is_running:
+            try:
+                await listen_for_events(session)
+                log("🔌 Event stream closed - polling until it's back")
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                log(f"❌ Event stream unavailable ({e}) - polling until it's back")
+            
+            await run_dispatch(session)
+            await asyncio.sleep(CHECK_INTERVAL)
+
 def main():
     """Main service loop"""
     log("🎯 Supervisor Service Started")
-    log(f"📍 Checking orders every {CHECK_INTERVAL} seconds")
+    log(f"📡 Dispatching on server events, heartbeat every {HEARTBEAT_INTERVAL} seconds")
     log(f"🌐 API Base URL: {BASE_URL}")
     
-    last_check = time.time()
-    
     try:
-        while is_running:
-            current_time = time.time()
-            
-            # Check if interval has passed
-            if current_time - last_check >= CHECK_INTERVAL:
-                log("\n" + "="*50)
-                process_orders_and_jobs()
-                log("="*50)
-                last_check = current_time
-            
-            # Small sleep to prevent CPU spinning
-            time.sleep(0.5)
-            
+        asyncio.run(serve())
     except KeyboardInterrupt:
         log("\n🛑 Supervisor Service stopped by user")
     except Exception as e:
@@ -101,4 +177,4 @@ def main():
         log("👋 Supervisor Service shut down")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()